@@ -7,19 +7,37 @@ import curses
 import curses.ascii
 import locale
 import os
+import re
+import shutil
 import string
+import subprocess
 import sys
+from bisect import bisect_right
 from collections import namedtuple
-from subprocess import Popen, PIPE
+from functools import lru_cache
+from itertools import accumulate, chain
 from textwrap import wrap
 import _curses
 
+_PRINTABLE = frozenset(string.printable)
+# Same set indexed by key code (0-255), for get_key
+_PRINTABLE_MASK = bytes(chr(i) in _PRINTABLE for i in range(256))
+# Runs of spaces and non-spaces: where wrap() may break text without hyphens
+_WORDSEP_RE = re.compile(r" +|[^ ]+")
+# wrap() replaces each of these characters with a space
+_WHITESPACE_TRANS = dict.fromkeys(map(ord, "\t\n\x0b\x0c\r"), " ")
+# Words with their trailing spaces (the first one also with any leading
+# spaces), or text that is all spaces
+_WORD_RE = re.compile(r" *[^ ]+ *|^ +$")
+
 
 def CTRL(key):
-    """ Args: key
+    """ Args: key - single character string or integer key code
+
+    Returns: integer key code, as returned by getch()
 
     """
-    return curses.ascii.ctrl(key)
+    return curses.ascii.ctrl(key if isinstance(key, int) else ord(key))
 
 
 def addstr(*args):
@@ -28,6 +46,214 @@ def addstr(*args):
     return scr.addstr(*args)
 
 
+def addnstr(*args):
+    """ Wrapper """
+    scr, args = args[0], args[1:]
+    return scr.addnstr(*args)
+
+
+def _one_cell_chars(text):
+    """Return True if every character of text takes up exactly one cell on
+    the screen (printable ASCII).
+
+    """
+    return text.isascii() and text.isprintable()
+
+
+# Return type of Editor.paragraph
+_Para = namedtuple("para", ['para_index', 'line_index', 'char_index'])
+
+
+def _in_table(key):
+    """Return True if key is a key code stored in _KeyMap.table
+
+    """
+    return isinstance(key, int) and 0 <= key <= curses.KEY_MAX
+
+
+class _KeyMap(dict):
+    """Key bindings (key code: handler) that also keep self.table, a list of
+    the handlers indexed by key code, so get_key can look up the usual key
+    codes (0 - curses.KEY_MAX) without hashing. The list follows any change
+    to the bindings.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table = [None] * (curses.KEY_MAX + 1)
+        self._table_init()
+
+    def _table_init(self):
+        table = self.table
+        table[:] = [None] * len(table)
+        for key, handler in self.items():
+            if _in_table(key):
+                table[key] = handler
+
+    def __setitem__(self, key, handler):
+        super().__setitem__(key, handler)
+        if _in_table(key):
+            self.table[key] = handler
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if _in_table(key):
+            self.table[key] = None
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self._table_init()
+
+    def pop(self, *args):
+        res = super().pop(*args)
+        self._table_init()
+        return res
+
+    def popitem(self):
+        res = super().popitem()
+        self._table_init()
+        return res
+
+    def setdefault(self, key, default=None):
+        res = super().setdefault(key, default)
+        self._table_init()
+        return res
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._table_init()
+
+
+# Longest paragraph string kept in the wrap memo. Every edit of a long
+# paragraph makes a new string that's rarely wrapped again, and the memo would
+# hold on to each of them.
+_WRAP_CACHE_MAX_LEN = 1000
+
+
+def _wrap(width, text, optimal=False):
+    """Word wrap a paragraph string. Returns a tuple so a memoized value
+    can't be modified by the caller.
+
+    """
+    if width < 1:
+        # No room for any text. wrap() raises ValueError, where _fast_wrap
+        # would never finish.
+        return tuple(wrap(text, width, drop_whitespace=False))
+    if optimal is True:
+        # Expand tabs etc. to spaces, like wrap() does
+        text = text.expandtabs().translate(_WHITESPACE_TRANS)
+        if text.isprintable():
+            lines = _optimal_wrap(text, width)
+            if lines is not None:
+                return tuple(lines)
+    if text.isascii() and text.isprintable() and "-" not in text:
+        return tuple(_fast_wrap(text, width))
+    return tuple(wrap(text, width, drop_whitespace=False))
+
+
+# Memoized _wrap, for paragraphs up to _WRAP_CACHE_MAX_LEN characters
+_wrap_cached = lru_cache(maxsize=256)(_wrap)
+
+
+def _fast_wrap(text, width):
+    """Same as wrap(text, width, drop_whitespace=False) for printable ASCII
+    text without hyphens, which is only ever broken between runs of spaces
+    and non-spaces (or inside a run longer than a line). Skips the regex
+    munging and the TextWrapper setup of textwrap. width must be at least 1.
+
+    """
+    lines = []
+    line = ""
+    for chunk in _WORDSEP_RE.findall(text):
+        if len(line) + len(chunk) <= width:
+            line += chunk
+        elif len(chunk) <= width:
+            lines.append(line)
+            line = chunk
+        else:
+            # Longer than a line: split it, starting on the current line
+            space_left = width - len(line)
+            lines.append(line + chunk[:space_left])
+            chunk = chunk[space_left:]
+            while len(chunk) > width:
+                lines.append(chunk[:width])
+                chunk = chunk[width:]
+            line = chunk
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _optimal_wrap(text, width):
+    """Wrap printable text so the lines are as even as possible: minimize the
+    sum of the squared free space at the end of each line but the last
+    (minimum raggedness, the Knuth-Plass line breaking model without
+    hyphenation). Lines are only broken after the spaces following a word,
+    so they still join up to the original text.
+
+    Returns: list of lines, or None if a word with its spaces doesn't fit on
+             a line
+
+    """
+    words = _WORD_RE.findall(text)
+    if any(len(i) > width for i in words):
+        return None
+    ends = list(accumulate(map(len, words), initial=0))
+    n = len(words)
+    # cost[i] is the least badness for wrapping words[:i], where the last of
+    # those lines starts with words[brk[i]]
+    cost = [0] * (n + 1)
+    brk = [0] * (n + 1)
+    for i in range(1, n + 1):
+        # Trailing spaces don't count as used space
+        spaces = len(words[i - 1]) - len(words[i - 1].rstrip(" "))
+        best = None
+        for j in range(i - 1, -1, -1):
+            length = ends[i] - ends[j]
+            if length > width:
+                # Starting the line any earlier won't fit either
+                break
+            slack = width - length + spaces
+            c = cost[j] if i == n else cost[j] + slack * slack
+            if best is None or c < best:
+                best = c
+                brk[i] = j
+        cost[i] = best
+    lines = []
+    i = n
+    while i > 0:
+        lines.append(text[ends[brk[i]]:ends[i]])
+        i = brk[i]
+    lines.reverse()
+    return lines
+
+
+def _tk_selection():
+    """Return the primary selection read with tkinter, or "" if it isn't
+    available. Fallback for paste() when xclip and xsel aren't installed.
+
+    """
+    try:
+        import tkinter
+    except ImportError:
+        return ""
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError:
+        return ""
+    try:
+        root.withdraw()
+        return root.selection_get(selection="PRIMARY")
+    except tkinter.TclError:
+        return ""
+    finally:
+        root.destroy()
+
+
 class Editor(object):
     """ Basic python curses text editor class.
 
@@ -52,6 +278,10 @@ class Editor(object):
                             (e.g. for passwords)
         edit:           True/False. Default is True for editor. Use False
                             to have a scrollable popup window.
+        optimal_wrap:   True/False. Default is False. Break lines so they
+                            are as even as possible instead of filling each
+                            line in turn. Slower, but a paragraph reflows
+                            less while it's edited.
 
     Returns:
         text:   text string
@@ -68,7 +298,7 @@ class Editor(object):
 
     def __init__(self, scr, title="", inittext="", win_location=(0, 0),
                  win_size=(20, 80), box=True, max_paragraphs=0, pw_mode=False,
-                 edit=True):
+                 edit=True, optimal_wrap=False):
         # Fix for python curses resize bug:
         # http://bugs.python.org/issue2675
         os.unsetenv('LINES')
@@ -79,12 +309,15 @@ class Editor(object):
         self.max_paragraphs = max_paragraphs
         self.pw_mode = pw_mode
         self.edit = edit
+        self.optimal_wrap = optimal_wrap
         self.win_location_orig_y, self.win_location_orig_x = win_location
         self.win_size_orig_y, self.win_size_orig_x = win_size
         self.win_size_y = self.win_size_orig_y
         self.win_size_x = self.win_size_orig_x
         self.win_location_y = self.win_location_orig_y
         self.win_location_x = self.win_location_orig_x
+        # Key read (and held back) while coalescing resize events
+        self._pending_key = None
         self.win_init()
         self.box_init()
         self.text_init(inittext)
@@ -96,13 +329,14 @@ class Editor(object):
                 pass
         else:
             self.keys_init()
+            self.paste_init()
             curses.curs_set(1)
         self.display()
 
     def __call__(self):
         self.run()
         curses.flushinp()
-        return "\n".join(["".join(i) for i in self.text])
+        return self._serialize()
 
     def win_init(self):
         """Set initial editor window size parameters, and reset them if window
@@ -119,6 +353,8 @@ class Editor(object):
         # (self.flattend_text)
         self.buffer_idx_y = 0
         self.buffer_idx_x = 0
+        # Length of the display buffer row at buffer_idx_y (None if unknown)
+        self._cur_buf_line_length = None
         # Make sure requested window size is < available window size
         self.max_win_size_y, self.max_win_size_x = self.scr.getmaxyx()
         # Keep the input box inside the physical window
@@ -168,60 +404,138 @@ class Editor(object):
             loc_off_y += 1
         if self.box is True or self.title_orig:
             # Make box/title screen bigger than actual text area (stdscr)
-            self.boxscr = self.scr.subwin(self.win_size_y,
-                                          self.win_size_x,
-                                          self.win_location_y,
-                                          self.win_location_x)
+            self.boxscr = self._subwin("boxscr",
+                                       self.win_size_y,
+                                       self.win_size_x,
+                                       self.win_location_y,
+                                       self.win_location_x)
             self.win_size_y = max(1, self.win_size_y - self.y_off)
             self.win_size_x = max(1, self.win_size_x - self.x_off)
-            self.stdscr = self.scr.subwin(self.win_size_y,
-                                          self.win_size_x,
-                                          self.win_location_y + loc_off_y,
-                                          self.win_location_x + loc_off_x)
+            self.stdscr = self._subwin("stdscr",
+                                       self.win_size_y,
+                                       self.win_size_x,
+                                       self.win_location_y + loc_off_y,
+                                       self.win_location_x + loc_off_x)
         else:
-            self.stdscr = self.scr.subwin(self.win_size_y,
-                                          self.win_size_x,
-                                          self.win_location_y,
-                                          self.win_location_x)
+            self.stdscr = self._subwin("stdscr",
+                                       self.win_size_y,
+                                       self.win_size_x,
+                                       self.win_location_y,
+                                       self.win_location_x)
+
+    def _subwin(self, name, nlines, ncols, begin_y, begin_x):
+        """Return the subwindow self.<name> resized to the given geometry.
+        A new subwindow of self.scr is only created the first time, if the
+        window has to move (mvwin doesn't move a subwindow's view of its
+        parent) or if curses refuses to resize the existing one.
+
+        """
+        win = getattr(self, name, None)
+        if win is not None and win.getbegyx() == (begin_y, begin_x):
+            try:
+                if win.getmaxyx() != (nlines, ncols):
+                    win.resize(nlines, ncols)
+                return win
+            except _curses.error:
+                pass
+        return self.scr.subwin(nlines, ncols, begin_y, begin_x)
 
     def text_init(self, text):
-        """Transform text string into a list of list of strings, wrapped to
-        fit the window size. Sets the dimensions of the text buffer. Each
-        paragraph is a new list.
+        """Transform text string into a list of strings, wrapped to fit the
+        window size. Sets the dimensions of the text buffer.
+
+        self._lines = ['This is a', 'long paragraph', 'short one']
+        self._para_line_starts = [0, 2, 3]
+                       ^ the first paragraph is lines 0 up to 2
+
+        """
+        self._text_init_from_paragraphs(text.splitlines() or [""])
+        # Keep the original text as a string for _restore_text()
+        self._text_orig = self._serialize()
+        if 0 < self.max_paragraphs < len(self._para_str):
+            # Truncates initial text
+            del self._lines[self._para_line_starts[self.max_paragraphs]:]
+            del self._para_line_starts[self.max_paragraphs + 1:]
+            del self._para_str[self.max_paragraphs:]
+            del self._line_offsets[self.max_paragraphs:]
+
+    def _text_init_from_paragraphs(self, paras):
+        """Word wrap a list of paragraph strings into self._lines. Also sets
+        self._para_line_starts, the index in self._lines of the first line of
+        each paragraph (the last item is the total number of lines),
+        self._para_str, the unwrapped string for each paragraph, and
+        self._line_offsets, the character offset within the paragraph string
+        of each wrapped line.
+
+        """
+        wrapped = [self._text_wrap([i]) for i in paras]
+        self._lines = list(chain.from_iterable(wrapped))
+        self._para_line_starts = list(accumulate(map(len, wrapped),
+                                                 initial=0))
+        # wrap() expands tabs and other whitespace characters, so only the
+        # joined lines are exact in that case.
+        self._para_str = [i if i.isprintable() else "".join(lines)
+                          for i, lines in zip(paras, wrapped)]
+        self._line_offsets = [list(accumulate(map(len, lines), initial=0))
+                              for lines in wrapped]
+        self._invalidate()
+
+    @property
+    def text(self):
+        """Return the wrapped text as a list of paragraphs, each a list of
+        strings (display lines).
+
+        """
+        starts = self._para_line_starts
+        return [self._lines[i:j] for i, j in zip(starts, starts[1:])]
+
+    @text.setter
+    def text(self, value):
+        """Replace the text with a list of paragraphs, each a list of strings.
+        The paragraphs are wrapped again to fit the window.
 
-        self.text = [['This is a', 'long paragraph'], ['short one']]
-                            ^this list^ is wrapped together as a paragraph
+        """
+        self._text_init_from_paragraphs(["".join(i) for i in value] or [""])
+
+    def _serialize(self):
+        """Return the text as a single string, one paragraph per line
 
         """
-        self.text = [self._text_wrap(i) or [""]
-                     for i in text.splitlines() or [""]]
-        self.text_orig = list(self.text)
-        if self.max_paragraphs:
-            # Truncates initial text if max_paragraphs < len(self.text)
-            self.text = self.text[:self.max_paragraphs]
+        return "\n".join(self._para_str)
 
-    def box_init(self):
+    def box_init(self, touch=True):
         """Clear the main screen and redraw the box and/or title
 
+        Args: touch - repaint the underlying screen too (not needed when
+                      nothing covered it and the editor didn't move)
+
         """
         # Touchwin seems to save the underlying screen and refreshes it (for
         # example when the help popup is drawn and cleared again)
-        self.scr.touchwin()
-        self.scr.refresh()
+        # The windows are only copied to the virtual screen here. They are
+        # written to the terminal together with the text by the next
+        # display(), so the screen is updated in one go.
+        if touch is True:
+            self.scr.touchwin()
+            self.scr.noutrefresh()
         self.stdscr.clear()
-        self.stdscr.refresh()
+        self.stdscr.noutrefresh()
+        # What display() last drew on each row: (text, paragraph marker).
+        # None makes display() redraw (and write out) every row.
+        self._last_rendered = [None] * self.win_size_y
+        self._needs_redraw = True
         if self.box is True:
             self.boxscr.clear()
             self.boxscr.box()
             if self.title:
                 addstr(self.boxscr, 1, 1, self.title, curses.A_BOLD)
                 addstr(self.boxscr, self.title_help, curses.A_STANDOUT)
-            self.boxscr.refresh()
+            self.boxscr.noutrefresh()
         elif self.title:
             self.boxscr.clear()
             addstr(self.boxscr, 0, 0, self.title, curses.A_BOLD)
             addstr(self.boxscr, self.title_help, curses.A_STANDOUT)
-            self.boxscr.refresh()
+            self.boxscr.noutrefresh()
 
     def keys_init(self):
         """Define methods for each key.
@@ -230,9 +544,7 @@ class Editor(object):
         self.keys = {
             curses.KEY_BACKSPACE:           self.backspace,
             CTRL('h'):                      self.backspace,
-            curses.ascii.BS:                self.backspace,
             curses.ascii.DEL:               self.backspace,
-            curses.ascii.ETX:               self.close,
             curses.KEY_DC:                  self.del_char,
             CTRL('d'):                      self.del_char,
             CTRL('u'):                      self.del_to_bol,
@@ -246,8 +558,6 @@ class Editor(object):
             CTRL('a'):                      self.home,
             curses.KEY_ENTER:               self.insert_line_or_quit,
             curses.ascii.NL:                self.insert_line_or_quit,
-            curses.ascii.LF:                self.insert_line_or_quit,
-            "\n":                           self.insert_line_or_quit,
             curses.KEY_LEFT:                self.left,
             CTRL('b'):                      self.left,
             curses.KEY_NPAGE:               self.page_down,
@@ -270,19 +580,18 @@ class Editor(object):
 
         """
         self.keys = {
-            curses.ascii.ETX:               self.close,
             curses.KEY_DOWN:                self.down_noedit,
             CTRL('n'):                      self.down_noedit,
-            'j':                            self.down_noedit,
+            ord('j'):                       self.down_noedit,
             curses.KEY_F1:                  self.help,
             curses.KEY_NPAGE:               self.page_down,
-            'J':                            self.page_down,
+            ord('J'):                       self.page_down,
             CTRL('f'):                      self.page_up,
             curses.KEY_PPAGE:               self.page_up,
-            'K':                            self.page_up,
+            ord('K'):                       self.page_up,
             CTRL('b'):                      self.page_up,
             CTRL('x'):                      self.quit,
-            'q':                            self.quit,
+            ord('q'):                       self.quit,
             curses.KEY_F2:                  self.quit,
             curses.KEY_F3:                  self.quit_nosave,
             curses.ascii.ESC:               self.quit_nosave,
@@ -290,9 +599,37 @@ class Editor(object):
             -1:                             self.resize,
             curses.KEY_UP:                  self.up_noedit,
             CTRL('p'):                      self.up_noedit,
-            'k':                            self.up_noedit,
+            ord('k'):                       self.up_noedit,
         }
 
+    def paste_init(self):
+        """Find the command paste() uses to read the primary selection, so
+        the programs aren't searched for on every paste. Sets
+        self._paste_cmd (None if neither xclip nor xsel is installed).
+
+        """
+        self._paste_cmd = None
+        for cmd in (['xclip', '-o', '-selection', 'primary'],
+                    ['xsel', '-o', '--primary']):
+            if shutil.which(cmd[0]):
+                self._paste_cmd = cmd
+                break
+
+    @property
+    def keys(self):
+        """Key bindings: {key code: method}. Any mapping assigned here is
+        copied to a _KeyMap, so get_key can use its table.
+
+        """
+        return self._keys
+
+    @keys.setter
+    def keys(self, value):
+        self._keys = _KeyMap(value)
+        # Codes up to curses.KEY_MAX are looked up here, any other codes
+        # (e.g. -1) in self.keys
+        self._key_table = self._keys.table
+
     def _title_init(self):
         """Initialze box title and help string
 
@@ -322,8 +659,16 @@ class Editor(object):
         """
         # Use win_size_x - 1 so addstr has one more cell at the end to put the
         # cursor
-        return wrap("".join(text), self.win_size_x - 1,
-                    drop_whitespace=False) or [""]
+        text = "".join(text)
+        width = self.win_size_x - 1
+        if not text:
+            return [""]
+        if len(text) <= width and text.isprintable():
+            # Fits on one line and there are no tabs etc. for wrap() to expand
+            return [text]
+        if len(text) > _WRAP_CACHE_MAX_LEN:
+            return list(_wrap(width, text, self.optimal_wrap))
+        return list(_wrap_cached(width, text, self.optimal_wrap))
 
     def left(self):
         if self.cur_pos_x > 0:
@@ -337,7 +682,7 @@ class Editor(object):
         if self.cur_pos_x < self.win_size_x and \
                 self.cur_pos_x < self.buf_line_length:
             self.cur_pos_x = self.cur_pos_x + 1
-        elif self.buffer_idx_y == len(self.flattened_text) - 1:
+        elif self.buffer_idx_y == len(self._lines) - 1:
             pass
         else:
             self.down()
@@ -356,10 +701,11 @@ class Editor(object):
         self.y_offset = max(0, self.y_offset - 1)
 
     def down(self):
+        last_idx_y = len(self._lines) - 1
         if self.cur_pos_y < self.win_size_y - 1 and \
-                self.buffer_idx_y < len(self.flattened_text) - 1:
+                self.buffer_idx_y < last_idx_y:
             self.cur_pos_y = self.cur_pos_y + 1
-        elif self.buffer_idx_y == len(self.flattened_text) - 1:
+        elif self.buffer_idx_y == last_idx_y:
             pass
         else:
             self.y_offset = min(self.buffer_rows - self.win_size_y,
@@ -387,14 +733,16 @@ class Editor(object):
         self._set_buffer_idx_x()
 
     def page_down(self):
-        if len(self.flattened_text) < self.win_size_y and \
+        flat_len = len(self._lines)
+        # Largest y_offset (same as self.buffer_rows - self.win_size_y)
+        max_offset = max(self.win_size_y, flat_len) - self.win_size_y
+        if flat_len < self.win_size_y and \
                 self.y_offset == 0:
-            self.cur_pos_y = len(self.flattened_text) - 1
+            self.cur_pos_y = flat_len - 1
         elif self.cur_pos_y < self.win_size_y and \
-                self.y_offset >= self.buffer_rows - self.win_size_y:
+                self.y_offset >= max_offset:
             self.cur_pos_y = self.win_size_y - 1
-        self.y_offset = min(self.buffer_rows - self.win_size_y,
-                            self.y_offset + self.win_size_y)
+        self.y_offset = min(max_offset, self.y_offset + self.win_size_y)
         # Corrects negative offsets
         self.y_offset = max(0, self.y_offset)
         self._set_buffer_idx_y()
@@ -405,7 +753,7 @@ class Editor(object):
         """Return current line (paragraph) as a string
 
         """
-        return "".join(self.text[self.paragraph.para_index])
+        return self._para_str[self._para_index()]
 
     @line.setter
     def line(self, value):
@@ -414,40 +762,123 @@ class Editor(object):
         Args: value - string
 
         """
-        p_idx, l_idx, _ = self.paragraph
-        self.text[p_idx] = self._text_wrap([value])
+        self._set_para(self._para_index(), value)
+
+    def _set_para(self, p_idx, value):
+        """Word wrap string value and store it as paragraph p_idx, keeping
+        self._para_line_starts, self._para_str and self._line_offsets in sync
+        with self._lines.
+
+        """
+        starts = self._para_line_starts
+        start, stop = starts[p_idx], starts[p_idx + 1]
+        old = self._para_str[p_idx]
+        if start < stop and len(value) > len(old) and \
+                value.startswith(old) and self.optimal_wrap is False:
+            # Text typed at the end of the paragraph. If it still fits on the
+            # last line the other lines can't change (without hyphens,
+            # wrap() only breaks between runs of spaces and non-spaces), so
+            # skip wrapping the whole paragraph again.
+            tail = value[len(old):]
+            last = self._lines[stop - 1] + tail
+            if len(last) <= self.win_size_x - 1 and "-" not in last and \
+                    tail.isprintable():
+                self._lines[stop - 1] = last
+                self._para_str[p_idx] = value
+                self._line_offsets[p_idx][-1] += len(tail)
+                self._invalidate()
+                return
+        lines = self._text_wrap([value])
+        self._lines[start:stop] = lines
+        delta = len(lines) - (stop - start)
+        if delta:
+            starts[p_idx + 1:] = [i + delta for i in starts[p_idx + 1:]]
+        # wrap() expands tabs and other whitespace characters, so only the
+        # joined lines are exact in that case.
+        self._para_str[p_idx] = value if value.isprintable() else \
+            "".join(lines)
+        self._line_offsets[p_idx] = list(accumulate(map(len, lines),
+                                                    initial=0))
+        self._invalidate()
+
+    def _insert_para(self, p_idx, value):
+        """Insert string value as a new paragraph at index p_idx.
+
+        """
+        self._insert_paras(p_idx, [value])
+
+    def _insert_paras(self, p_idx, values):
+        """Insert a list of strings as new paragraphs starting at index p_idx.
+        Each list is spliced only once, however many paragraphs are added.
+
+        """
+        wrapped = [self._text_wrap([i]) for i in values]
+        starts = self._para_line_starts
+        start = starts[p_idx]
+        lines = list(chain.from_iterable(wrapped))
+        self._lines[start:start] = lines
+        starts[p_idx:] = \
+            list(accumulate(map(len, wrapped[:-1]), initial=start)) + \
+            [i + len(lines) for i in starts[p_idx:]]
+        # wrap() expands tabs and other whitespace characters, so only the
+        # joined lines are exact in that case.
+        self._para_str[p_idx:p_idx] = [
+            i if i.isprintable() else "".join(j)
+            for i, j in zip(values, wrapped)]
+        self._line_offsets[p_idx:p_idx] = [
+            list(accumulate(map(len, i), initial=0)) for i in wrapped]
+        self._invalidate()
+
+    def _del_para(self, p_idx):
+        """Remove paragraph p_idx.
+
+        """
+        starts = self._para_line_starts
+        start, stop = starts[p_idx], starts[p_idx + 1]
+        del self._lines[start:stop]
+        starts[p_idx + 1:] = [i - (stop - start) for i in starts[p_idx + 2:]]
+        del self._para_str[p_idx]
+        del self._line_offsets[p_idx]
+        self._invalidate()
+
+    def _invalidate(self):
+        """Forget values cached from self._lines and flag the text for
+        redrawing. Must be called whenever paragraphs are added, removed or
+        replaced.
+
+        """
+        self._cur_buf_line_length = None
+        self._needs_redraw = True
 
     @property
     def flattened_text(self):
-        """Return a flattened self.text (single list of strings)
+        """Return a copy of the display lines of all paragraphs (single list of
+        strings)
 
         """
-        return [j for i in self.text for j in i] or [""]
+        return list(self._lines)
 
     def _char_index_to_yx(self, para_index, char_index):
         """Given the char_index for a paragraph, set buffer_idx_y,
         buffer_idx_x, cur_pos_y and cur_pos_x
 
         """
-        line_idx = c_index = 0
-        done = False
-        for line_idx, line in enumerate(self.text[para_index]):
-            x_pos = 0
-            for c in line:
-                if c_index == char_index:
-                    done = True
-                    break
-                c_index += 1
-                x_pos += 1
-            if done is True:
-                break
-        self.buffer_idx_x = x_pos
-        prev_paras_len = sum(map(len, self.text[:para_index]))
-        self.buffer_idx_y = prev_paras_len + line_idx
-        while self.buffer_idx_y - self.y_offset >= self.win_size_y:
-            self.y_offset += 1
-        while self.buffer_idx_y - self.y_offset < 0:
-            self.y_offset -= 1
+        # An index on a line boundary belongs to the start of the next line,
+        # an index past the end of the paragraph to the end of the last line.
+        offsets = self._line_offsets[para_index]
+        line_idx = bisect_right(offsets, char_index) - 1
+        if line_idx < len(offsets) - 1:
+            self.buffer_idx_x = char_index - offsets[line_idx]
+        else:
+            line_idx = len(offsets) - 2
+            self.buffer_idx_x = offsets[-1] - offsets[-2]
+        self.buffer_idx_y = self._para_line_starts[para_index] + line_idx
+        self._cur_buf_line_length = None
+        # Scroll just enough to bring buffer_idx_y into view
+        if self.buffer_idx_y - self.y_offset >= self.win_size_y:
+            self.y_offset = self.buffer_idx_y - self.win_size_y + 1
+        elif self.buffer_idx_y < self.y_offset:
+            self.y_offset = self.buffer_idx_y
         self.cur_pos_y = self.buffer_idx_y - self.y_offset
         self.cur_pos_x = self.buffer_idx_x
 
@@ -460,21 +891,23 @@ class Editor(object):
         Returns: namedtuple (para_index, line_index, char_index)
 
         """
-        idx_para = idx_buffer = idx_line = idx_char = 0
-        done = False
-        for para in self.text:
-            for idx_line, line in enumerate(para):
-                if idx_buffer == self.buffer_idx_y:
-                    done = True
-                    break
-                idx_buffer += 1
-            if done is True:
-                break
-            idx_para += 1
-        idx_char = sum(map(len, self.text[idx_para][:idx_line])) + \
-            self.buffer_idx_x
-        p = namedtuple("para", ['para_index', 'line_index', 'char_index'])
-        return p(idx_para, idx_line, idx_char)
+        return _Para(*self._paragraph())
+
+    def _paragraph(self):
+        """Same as paragraph, as a plain tuple (used within the class, where
+        the result is always unpacked)
+
+        """
+        idx_para = self._para_index()
+        idx_line = self.buffer_idx_y - self._para_line_starts[idx_para]
+        idx_char = self._line_offsets[idx_para][idx_line] + self.buffer_idx_x
+        return idx_para, idx_line, idx_char
+
+    def _para_index(self):
+        """Return the index of the current paragraph
+
+        """
+        return bisect_right(self._para_line_starts, self.buffer_idx_y) - 1
 
     @property
     def line_length(self):
@@ -488,14 +921,17 @@ class Editor(object):
         """Return a string for the current display buffer row
 
         """
-        return self.flattened_text[self.buffer_idx_y]
+        return self._lines[self.buffer_idx_y]
 
     @property
     def buf_line_length(self):
-        """Return the string length of the current single displayed row
+        """Return the string length of the current single displayed row. The
+        value is cached until the cursor changes rows or the text is edited.
 
         """
-        return len(self.buf_line)
+        if self._cur_buf_line_length is None:
+            self._cur_buf_line_length = len(self._lines[self.buffer_idx_y])
+        return self._cur_buf_line_length
 
     @property
     def buffer_rows(self):
@@ -503,26 +939,29 @@ class Editor(object):
         greater.
 
         """
-        return max(self.win_size_y, len(self.flattened_text))
+        return max(self.win_size_y, len(self._lines))
 
     def _set_buffer_idx_y(self):
-        """Set buffer_idx_y (y position in self.flattened_text)
+        """Set buffer_idx_y (y position in self._lines)
 
         """
-        if self.cur_pos_y + self.y_offset > len(self.flattened_text) - 1:
-            self.buffer_idx_y = len(self.flattened_text)
+        flat_len = len(self._lines)
+        if self.cur_pos_y + self.y_offset > flat_len - 1:
+            self.buffer_idx_y = flat_len
         else:
             self.buffer_idx_y = self.cur_pos_y + self.y_offset
+        self._cur_buf_line_length = None
 
     def _set_buffer_idx_x(self):
-        """Set buffer_idx_x (x position in self.flattened_text
+        """Set buffer_idx_x (x position in self._lines
 
         This doesn't matter much right now because it will always be the same
         as self.cur_pos_x because we don't have side-scrolling yet.
 
         """
-        if self.cur_pos_x > self.buf_line_length:
-            self.cur_pos_x = self.buf_line_length
+        buf_line_length = self.buf_line_length
+        if self.cur_pos_x > buf_line_length:
+            self.cur_pos_x = buf_line_length
         self.buffer_idx_x = self.cur_pos_x
 
     def insert_char(self, c):
@@ -530,13 +969,12 @@ class Editor(object):
         line. Stop when the maximum line length is reached.
 
         """
-        if c not in string.printable:
+        if not isinstance(c, str) or c not in _PRINTABLE:
             return
-        para_idx, line_idx, char_idx = self.paragraph
-        line = list(self.line)
-        line.insert(char_idx, c)
+        para_idx, line_idx, char_idx = self._paragraph()
+        line = self._para_str[para_idx]
+        self._set_para(para_idx, line[:char_idx] + c + line[char_idx:])
         char_idx += 1
-        self.line = "".join(line)
         self._char_index_to_yx(para_idx, char_idx)
 
     def insert_line_or_quit(self):
@@ -548,30 +986,27 @@ class Editor(object):
         if self.max_paragraphs == 1:
             # Save and quit for single-line entries
             return False
-        if 0 < self.max_paragraphs <= len(self.text):
+        if 0 < self.max_paragraphs <= len(self._para_str):
             return
-        p_idx, _, c_idx = self.paragraph
-        newline = self.line[c_idx:]
-        line = self.line[:c_idx]
-        self.text[p_idx] = self._text_wrap([line])
-        self.text.insert(p_idx + 1, self._text_wrap([newline]))
+        p_idx, _, c_idx = self._paragraph()
+        line = self._para_str[p_idx]
+        self._set_para(p_idx, line[:c_idx])
+        self._insert_para(p_idx + 1, line[c_idx:])
         self._char_index_to_yx(p_idx + 1, 0)
 
     def backspace(self):
         """Delete character to the left of the cursor and move one space left.
 
         """
-        para_idx, line_idx, char_idx = self.paragraph
-        line = list(self.line)
+        para_idx, line_idx, char_idx = self._paragraph()
+        line = self._para_str[para_idx]
         if char_idx > 0:
-            del line[char_idx - 1]
+            self._set_para(para_idx, line[:char_idx - 1] + line[char_idx:])
             char_idx -= 1
-            self.line = "".join(line)
         elif para_idx > 0 and char_idx == 0:
-            oldline = "".join(self.text[para_idx - 1])
-            newline = oldline + "".join(line)
-            self.text[para_idx - 1] = self._text_wrap([newline])
-            del self.text[para_idx]
+            oldline = self._para_str[para_idx - 1]
+            self._set_para(para_idx - 1, oldline + line)
+            self._del_para(para_idx)
             char_idx = len(oldline)
             para_idx -= 1
         else:
@@ -582,15 +1017,13 @@ class Editor(object):
         """Delete character under the cursor.
 
         """
-        para_idx, line_idx, char_idx = self.paragraph
-        line = list(self.line)
+        para_idx, line_idx, char_idx = self._paragraph()
+        line = self._para_str[para_idx]
         if line and char_idx < len(line):
-            del line[char_idx]
-            self.line = "".join(line)
-        elif char_idx == len(line) and para_idx < len(self.text) - 1:
-            nextline = "".join(self.text[para_idx + 1])
-            self.line = "".join("".join(line) + nextline)
-            del self.text[para_idx + 1]
+            self._set_para(para_idx, line[:char_idx] + line[char_idx + 1:])
+        elif char_idx == len(line) and para_idx < len(self._para_str) - 1:
+            self._set_para(para_idx, line + self._para_str[para_idx + 1])
+            self._del_para(para_idx + 1)
         else:
             pass
         self._char_index_to_yx(para_idx, char_idx)
@@ -599,25 +1032,24 @@ class Editor(object):
         """Delete from cursor to end of current line. (C-k)
 
         """
-        para_idx, line_idx, char_idx = self.paragraph
-        start = self.line[:char_idx]
+        para_idx, line_idx, char_idx = self._paragraph()
+        line = self._para_str[para_idx]
         clip_len = self.buf_line_length - self.buffer_idx_x
-        end = self.line[char_idx + clip_len:]
-        self.line = start + end
+        self._set_para(para_idx, line[:char_idx] + line[char_idx + clip_len:])
 
     def del_to_bol(self):
         """Delete from cursor to beginning of current line. (C-u)
 
         """
-        para_idx, line_idx, char_idx = self.paragraph
-        start = self.line[:char_idx - self.buffer_idx_x]
-        end = self.line[char_idx:]
-        self.line = start + end
+        para_idx, line_idx, char_idx = self._paragraph()
+        line = self._para_str[para_idx]
+        self._set_para(para_idx,
+                       line[:char_idx - self.buffer_idx_x] + line[char_idx:])
         self._char_index_to_yx(para_idx, char_idx - self.buffer_idx_x)
 
     def paste(self):
-        """Use xsel or xclip if available to paste and process a large chunk of
-        text all at once.
+        """Use xsel or xclip if available (else tkinter) to paste and process a
+        large chunk of text all at once.
 
         """
         res = ""
@@ -625,49 +1057,48 @@ class Editor(object):
             os.environ['DISPLAY']
         except KeyError:
             return
-        for cmd in (['xclip', '-o', '-selection', 'primary'],
-                    ['xsel', '-o', '--primary']):
+        if self._paste_cmd is None:
+            res = _tk_selection()
+        else:
             try:
-                res = Popen(cmd, stdout=PIPE,
-                            universal_newlines=True).communicate()[0]
-            except IOError:
-                continue
-            else:
-                break
-        para_idx, line_idx, char_idx = self.paragraph
+                res = subprocess.run(self._paste_cmd, capture_output=True,
+                                     text=True).stdout
+            except OSError:
+                pass
+        para_idx, line_idx, char_idx = self._paragraph()
         if not res:
             return
         if sys.version_info.major < 3:
             enc = locale.getpreferredencoding() or 'utf-8'
             res = str(res, encoding=enc)
         res = res.splitlines()
+        line = self._para_str[para_idx]
         if len(res) == 1:
-            line = list(self.line)
-            cur_line_paste = list(res[0])
-            line[char_idx:char_idx] = cur_line_paste
-            char_idx += len(cur_line_paste)
-            self.line = "".join(line)
+            self._set_para(para_idx,
+                           line[:char_idx] + res[0] + line[char_idx:])
+            char_idx += len(res[0])
         else:
-            line = list(self.line)
-            beg_line = line[:char_idx]
-            end_line = "".join(line[char_idx:])
-            first_line_paste = list(res[0])
-            beg_line.extend(first_line_paste)
-            self.line = "".join(beg_line)
-            ins = [self._text_wrap(i) for i in res[1:]]
-            self.text[para_idx + 1:para_idx + 1] = ins
-            para_idx += len(res[1:])
-            self.text[para_idx].append(end_line)
-            self.text[para_idx] = self._text_wrap(self.text[para_idx])
-            char_idx = sum(len(i) for i in self.text[para_idx])
+            end_line = line[char_idx:]
+            self._set_para(para_idx, line[:char_idx] + res[0])
+            paras = res[1:]
+            paras[-1] += end_line
+            self._insert_paras(para_idx + 1, paras)
+            para_idx += len(paras)
+            char_idx = len(self._para_str[para_idx])
         self._char_index_to_yx(para_idx, char_idx)
 
     def quit(self):
         return False
 
+    def _restore_text(self):
+        """Discard any edits and restore the original text.
+
+        """
+        self._text_init_from_paragraphs(self._text_orig.split("\n"))
+
     def quit_nosave(self):
         self.edit = False  # Used to detect that quit_nosave was triggered
-        self.text = self.text_orig
+        self._restore_text()
         return False
 
     def help(self):
@@ -708,8 +1139,11 @@ class Editor(object):
         except _curses.error:
             pass
         else:
-            while not popup.getch():
-                pass
+            # Any key closes the popup
+            popup.keypad(True)
+            popup.noutrefresh()
+            curses.doupdate()
+            popup.getch()
         finally:
             # Turn back on the cursor
             if self.pw_mode is False and self.edit is True:
@@ -721,12 +1155,42 @@ class Editor(object):
 
     def resize(self):
         """Handle window resizing."""
+        self._drain_resize_events()
         if curses.is_term_resized(self.max_win_size_y, self.max_win_size_x):
+            geometry = self._geometry()
+            win_size_x = self.win_size_x
             self.win_init()
-            self.box_init()
-            self.text = [self._text_wrap(i) for i in self.text]
+            self.box_init(touch=self._geometry() != geometry)
+            if self.win_size_x != win_size_x:
+                self._text_init_from_paragraphs(self._para_str)
             curses.resizeterm(self.max_win_size_y, self.max_win_size_x)
 
+    def _geometry(self):
+        """Return the location and size of the editor window(s)
+
+        """
+        return (self.win_location_y, self.win_location_x,
+                self.win_size_y, self.win_size_x)
+
+    def _drain_resize_events(self):
+        """Discard any further queued KEY_RESIZE events (e.g. while the
+        terminal is being dragged to a new size) so the windows are only
+        rebuilt once, for the final size. The first other key found is kept
+        in self._pending_key for get_key.
+
+        """
+        self.stdscr.nodelay(True)
+        try:
+            while True:
+                c = self.stdscr.getch()
+                if c == curses.KEY_RESIZE:
+                    continue
+                if c != -1:
+                    self._pending_key = c
+                break
+        finally:
+            self.stdscr.nodelay(False)
+
     def run(self):
         """Main program loop.
 
@@ -737,58 +1201,119 @@ class Editor(object):
                 loop = self.get_key()
                 if loop is False:
                     break
-                self.display()
+                self._redraw()
         except KeyboardInterrupt:
-            self.text = self.text_orig
-        return "\n".join(["".join(i) for i in self.text])
+            self._restore_text()
+        return self._serialize()
 
     def display(self):
         """Display the editor window and the current contents.
 
+        Only the rows that changed since they were last drawn are redrawn.
+
         """
-        self.stdscr.erase()
-        y_idx = display_idx = 0
-        done = False
-        for para in self.text:
-            for line_idx, line in enumerate(para):
-                if y_idx >= self.y_offset and display_idx < self.win_size_y:
-                    if not self.pw_mode:
-                        addstr(self.stdscr, display_idx, 0, line)
-                    if len(self.text) > 1 and line_idx == len(para) - 1 \
-                            and self.edit is True:
-                        # Show an end of paragraph marker on last line.
-                        self.stdscr.insch(display_idx, self.win_size_x - 1,
-                                          curses.ACS_LARROW)
-                    display_idx += 1
-                elif display_idx >= self.win_size_y:
-                    done = True
-                    break
-                y_idx += 1
-            if done is True:
-                break
-        self.stdscr.refresh()
+        markers = len(self._para_str) > 1 and self.edit is True
+        if self._display_lines(markers) is True:
+            self.stdscr.noutrefresh()
+            curses.doupdate()
+        self._drawn_y_offset = self.y_offset
+        self._needs_redraw = False
+
+    def _redraw(self):
+        """Call display() only if the text was changed or scrolled since the
+        last call. Keys that just move the cursor don't need a redraw, the
+        cursor is placed by run() before reading the next key.
+
+        """
+        if self._needs_redraw is True or \
+                self.y_offset != self._drawn_y_offset:
+            self.display()
+
+    def _display_lines(self, markers):
+        """Redraw the rows of the window whose text or paragraph marker is
+        not the same as in self._last_rendered (called from display)
+
+        Args: markers - True/False whether to show end of paragraph markers
+        Returns: True if any row was redrawn
+
+        """
+        stdscr = self.stdscr
+        flat = self._lines
+        nlines = len(flat)
+        starts = self._para_line_starts
+        rendered = self._last_rendered
+        show_text = not self.pw_mode
+        larrow = curses.ACS_LARROW
+        y_offset = self.y_offset
+        # Never write into the last column: that cell is kept free for the
+        # cursor and the paragraph marker.
+        width = self.win_size_x - 1
+        # Index in starts of the paragraph following the current line
+        p_idx = bisect_right(starts, y_offset)
+        changed = False
+        for display_idx in range(self.win_size_y):
+            y_idx = y_offset + display_idx
+            if y_idx < nlines:
+                # The text is never shown in password mode
+                text = flat[y_idx] if show_text else ""
+                para_end = starts[p_idx] == y_idx + 1
+                if para_end:
+                    p_idx += 1
+                row = (text, markers and para_end)
+            else:
+                row = ("", False)
+            old = rendered[display_idx]
+            if row == old:
+                continue
+            rendered[display_idx] = row
+            changed = True
+            text, marker = row
+            # A cleared row (old is None) has no marker
+            marker_shown = old is not None and old[1]
+            if old is None or text != old[0]:
+                if width > 0 and _one_cell_chars(text) and \
+                        (old is None or _one_cell_chars(old[0])):
+                    # Overwrite the old text in a single write, padded with
+                    # spaces up to (and leaving alone) the marker column
+                    addnstr(stdscr, display_idx, 0, text.ljust(width), width)
+                else:
+                    stdscr.move(display_idx, 0)
+                    stdscr.clrtoeol()
+                    marker_shown = False
+                    if text:
+                        addnstr(stdscr, display_idx, 0, text, width)
+            if marker and not marker_shown:
+                # Show an end of paragraph marker on last line.
+                stdscr.insch(display_idx, width, larrow)
+            elif marker_shown and not marker:
+                stdscr.move(display_idx, width)
+                stdscr.clrtoeol()
+        return changed
 
     def close(self):
-        self.text = self.text_orig
+        self._restore_text()
         curses.endwin()
         curses.flushinp()
         return False
 
     def get_key(self):
-        c = self.stdscr.getch()
+        if self._pending_key is not None:
+            c, self._pending_key = self._pending_key, None
+        else:
+            c = self.stdscr.getch()
         if c == curses.KEY_RESIZE:
             self.resize()
             return True
-        # 127 and 27 are to make sure the Backspace/ESC keys work properly
-        if 0 < c < 256 and c != 127 and c != 27:
-            c = chr(c)
-        try:
-            loop = self.keys[c]()
-        except KeyError:
-            if self.edit is True:
-                self.insert_char(c)
-            loop = True
-        return loop
+        # Usual key codes are looked up in the table built from self.keys
+        if 0 <= c <= curses.KEY_MAX:
+            handler = self._key_table[c]
+        else:
+            handler = self.keys.get(c)
+        if handler is not None:
+            return handler()
+        if self.edit is True and 0 < c < 256 and _PRINTABLE_MASK[c]:
+            self.insert_char(chr(c))
+        return True
 
 
 def main(stdscr, **kwargs):
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 import curses
+import curses.ascii
+import itertools
+import random
+import textwrap
+import unicodedata
 import unittest
 import editor.editor as e
 
@@ -29,30 +34,239 @@ class TestIntegration(unittest.TestCase):
     and some of the non-interactive movements.
 
     """
+    @classmethod
+    def setUpClass(cls):
+        # One curses session for all the tests (set up as curses.wrapper does)
+        cls.stdscr = curses.initscr()
+        try:
+            curses.noecho()
+            curses.cbreak()
+            cls.stdscr.keypad(True)
+            try:
+                curses.start_color()
+            except curses.error:
+                pass
+        except Exception:
+            cls.tearDownClass()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stdscr.keypad(False)
+        curses.echo()
+        curses.nocbreak()
+        curses.endwin()
+
     def setUp(self):
-        pass
+        self.stdscr.clear()
 
     def main(self, stdscr, *args, **kwargs):
         v = e.Editor(stdscr, *args, **kwargs)
         v.display()
-        for key in v.keys:
-            if key not in (curses.KEY_F1, curses.ascii.ESC, curses.ascii.ETX):
-                v.keys[key]()
-        v.keys[curses.KEY_F2]
+        # Skip help (waits for a key press) and the keys that quit curses
+        skip = frozenset((curses.KEY_F1, curses.ascii.ESC, curses.ascii.ETX))
+        actions = tuple(fn for key, fn in v.keys.items() if key not in skip)
+        for fn in actions:
+            fn()
 
     def test_1(self):
-        curses.wrapper(self.main, title="Test", inittext=str1,
-                       win_location=(0, 0), win_size=(50, 80),
-                       box=False)
+        self.main(self.stdscr, title="Test", inittext=str1,
+                  win_location=(0, 0), win_size=(50, 80),
+                  box=False)
 
     def test_2(self):
-        curses.wrapper(self.main, title=str1, inittext=str2,
-                       win_location=(0, 0), win_size=(100, 400),
-                       box=True)
+        self.main(self.stdscr, title=str1, inittext=str2,
+                  win_location=(0, 0), win_size=(100, 400),
+                  box=True)
 
     def test_3(self):
-        curses.wrapper(self.main, title=str1, inittext=str2,
-                       edit=False)
+        self.main(self.stdscr, title=str1, inittext=str2,
+                  edit=False)
+
+    def test_4(self):
+        self.main(self.stdscr, title=str1, inittext=str2,
+                  win_location=(0, 0), win_size=(20, 40),
+                  optimal_wrap=True)
+
+    def test_flattened_text_copy_and_text_setter(self):
+        v = e.Editor(self.stdscr, inittext=str1, win_size=(10, 20))
+        v.flattened_text.append("not in the editor")
+        self.assertEqual(v.flattened_text, [j for i in v.text for j in i])
+        v.text = [["one ", "two"], ["three"]]
+        self.assertEqual(v.text, [["one two"], ["three"]])
+
+    def test_set_para_append(self):
+        # Appending to a paragraph may skip the rewrap: the result must match
+        # wrapping the paragraph again from scratch.
+        rnd = random.Random(0)
+        v = e.Editor(self.stdscr, inittext="first\n\nthird one",
+                     win_size=(10, 20))
+        for _ in range(500):
+            p_idx = rnd.randrange(len(v._para_str))
+            tail = "".join(rnd.choice("ab  -")
+                           for _ in range(rnd.randint(1, 4)))
+            v._set_para(p_idx, v._para_str[p_idx] + tail)
+            state = (v._lines, v._para_line_starts, v._line_offsets)
+            fresh = e.Editor(self.stdscr, inittext="\n".join(v._para_str),
+                             win_size=(10, 20))
+            self.assertEqual(state, (fresh._lines, fresh._para_line_starts,
+                                     fresh._line_offsets))
+
+    def assertScreen(self, v):
+        """Check every row of the window against the wrapped text: the row
+        text, and the paragraph marker in the last column.
+
+        """
+        rows = []
+        for para in v.text:
+            rows += [(line, False) for line in para[:-1]]
+            rows.append((para[-1], len(v.text) > 1))
+        rows = rows[v.y_offset:v.y_offset + v.win_size_y]
+        rows += [("", False)] * (v.win_size_y - len(rows))
+        width = v.win_size_x - 1
+        for y, (text, marker) in enumerate(rows):
+            # instr() counts bytes, not cells: read the whole row and cut it
+            # at the marker column
+            shown, cells = "", 0
+            for c in v.stdscr.instr(y, 0).decode('utf-8'):
+                cells += 2 if unicodedata.east_asian_width(c) == "W" else 1
+                if cells > width:
+                    break
+                shown += c
+            self.assertEqual(shown.rstrip(), text.rstrip(), (y, v.y_offset))
+            last = v.stdscr.inch(y, width) & curses.A_CHARTEXT
+            expected = curses.ACS_LARROW if marker else ord(" ")
+            self.assertEqual(last, expected & curses.A_CHARTEXT,
+                             (y, v.y_offset))
+
+    def test_display(self):
+        v = e.Editor(self.stdscr, inittext="one two three four\nĐorđe "
+                     "Balašević\n日本語\nabc\ndef ghi jkl\nmno\npqr\nstu",
+                     win_size=(5, 12), box=False)
+        v.display()
+        self.assertScreen(v)
+        K = curses
+        # Join the first two paragraphs (ASCII and non-ASCII rows swap, the
+        # marker moves), split them again, then edit and scroll at random.
+        keys = [K.KEY_DOWN, K.KEY_DOWN, K.KEY_HOME, K.KEY_BACKSPACE,
+                ord("\n"), K.KEY_NPAGE, K.KEY_PPAGE]
+        rnd = random.Random(0)
+        keys += [rnd.choice([ord("a"), ord(" "), ord("\n"), K.KEY_BACKSPACE,
+                             K.KEY_DC, K.KEY_UP, K.KEY_DOWN, K.KEY_LEFT,
+                             K.KEY_RIGHT, K.KEY_NPAGE, K.KEY_PPAGE])
+                 for _ in range(300)]
+        for key in keys:
+            curses.ungetch(key)
+            v.get_key()
+            v._redraw()
+            self.assertScreen(v)
+
+    def test_keys_init_override(self):
+        # A subclass only has to set self.keys
+        pressed = []
+
+        class Editor(e.Editor):
+            def keys_init(self):
+                self.keys = {ord('z'): lambda: pressed.append('z')}
+
+        v = Editor(self.stdscr, inittext=str1)
+        curses.ungetch(ord('z'))
+        v.get_key()
+        self.assertEqual(pressed, ['z'])
+
+    def test_keys_rebind(self):
+        pressed = []
+        v = e.Editor(self.stdscr, inittext="abc")
+        v.keys[ord('z')] = lambda: pressed.append('z')
+        v.keys[curses.KEY_F2] = lambda: pressed.append('F2')
+        for key in (ord('z'), curses.KEY_F2):
+            curses.ungetch(key)
+            v.get_key()
+        self.assertEqual(pressed, ['z', 'F2'])
+        # An unbound printable key is inserted again
+        del v.keys[ord('z')]
+        curses.ungetch(ord('z'))
+        v.get_key()
+        self.assertIn('z', v.flattened_text[0])
+        v.keys = {ord('y'): lambda: pressed.append('y')}
+        for key in (ord('y'), curses.KEY_F2):
+            curses.ungetch(key)
+            v.get_key()
+        self.assertEqual(pressed, ['z', 'F2', 'y'])
+
+    def test_ctrl_c_unbound(self):
+        # Ctrl-c in raw mode (ETX) doesn't close the editor or end curses
+        for edit in (True, False):
+            v = e.Editor(self.stdscr, inittext=str1, edit=edit)
+            curses.ungetch(curses.ascii.ETX)
+            self.assertIs(v.get_key(), True)
+            self.assertFalse(curses.isendwin())
+            self.assertEqual(v.text, e.Editor(self.stdscr, inittext=str1).text)
+
+
+class TestHelpers(unittest.TestCase):
+    """Unit tests for the module level helpers. These don't need a terminal.
+
+    """
+    def test_ctrl(self):
+        self.assertEqual(e.CTRL('x'), 24)
+        self.assertEqual(e.CTRL(ord('x')), 24)
+
+    def test_key_map_table(self):
+        keys = e._KeyMap({1: "a", -1: "b"})
+        keys.update({2: "c"})
+        keys.setdefault(3, "d")
+        keys |= {4: "e"}
+        keys.pop(1)
+        self.assertEqual(keys.table[:5], [None, None, "c", "d", "e"])
+        keys.clear()
+        self.assertEqual(keys.table, [None] * len(keys.table))
+
+    def test_fast_wrap(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            text = "".join(rnd.choice("ab   cdefg")
+                           for _ in range(rnd.randint(1, 60)))
+            width = rnd.randint(1, 12)
+            self.assertEqual(e._fast_wrap(text, width),
+                             textwrap.wrap(text, width, drop_whitespace=False))
+
+    def test_optimal_wrap(self):
+        def cost(lines, width):
+            # Squared free space at the end of each line but the last
+            return sum((width - len(i.rstrip(" "))) ** 2 for i in lines[:-1])
+
+        rnd = random.Random(0)
+        for _ in range(500):
+            text = "".join(rnd.choice("ab   cdefg")
+                           for _ in range(rnd.randint(1, 30)))
+            width = rnd.randint(1, 12)
+            lines = e._optimal_wrap(text, width)
+            words = e._WORD_RE.findall(text)
+            if lines is None:
+                # Only when a word with its spaces doesn't fit on a line
+                self.assertTrue(any(len(i) > width for i in words))
+                continue
+            self.assertEqual("".join(lines), text)
+            self.assertTrue(all(len(i) <= width for i in lines))
+            # Compare with every way of breaking the text between words
+            best = None
+            for breaks in itertools.product((False, True),
+                                            repeat=len(words) - 1):
+                split = [words[0]]
+                for word, brk in zip(words[1:], breaks):
+                    if brk:
+                        split.append(word)
+                    else:
+                        split[-1] += word
+                if all(len(i) <= width for i in split):
+                    c = cost(split, width)
+                    best = c if best is None else min(best, c)
+            self.assertEqual(cost(lines, width), best)
+
+    def test_wrap_zero_width(self):
+        # Used to loop forever in _fast_wrap
+        self.assertRaises(ValueError, e._wrap, 0, "hello world")
 
 
 if __name__ == '__main__':